@@ -12,18 +12,33 @@ class Settings:
     # OpenAI Configuration
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # Can switch to gpt-4o
+    # Worst case per query is (retries + 1) x timeout; the frontend's read
+    # timeout has to stay above that
+    LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", "45"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
     
     # File Upload Configuration
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "./uploads")
     MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
     ALLOWED_EXTENSIONS: set = {".csv", ".xlsx", ".xls"}
     
+    # Dataframe Cache Configuration (per worker process)
+    MAX_CACHE_MB: int = int(os.getenv("MAX_CACHE_MB", "512"))
+    
+    # LLM Response Cache Configuration (on disk, empty dir disables it)
+    LLM_CACHE_DIR: str = os.getenv("LLM_CACHE_DIR", os.path.join(UPLOAD_DIR, "llm_cache"))
+    LLM_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+    
     # Security Configuration
     API_KEY: str = os.getenv("API_KEY", "demo-api-key-change-in-production")
     
     # Server Configuration
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", "8000"))
+    # Each worker is a separate process with its own dataframe cache;
+    # parquet files and the LLM response cache on disk are shared.
+    WORKERS: int = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    RELOAD: bool = os.getenv("RELOAD", "false").lower() == "true"  # Dev only, forces one worker
     
     # Future: Azure Blob Storage (placeholder for extension)
     AZURE_STORAGE_CONNECTION_STRING: str = os.getenv("AZURE_STORAGE_CONNECTION_STRING", "")
@@ -1,23 +1,40 @@
 # FastAPI main application
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import shutil
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
+import sys
+import uuid
+from urllib.parse import unquote
 from pathlib import Path
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import aiofiles
+import orjson
 import uvicorn
+from pydantic import ValidationError
 
 from app.config import settings
 from app.models.schemas import FileUploadResponse, QueryRequest, QueryResponse
 from app.modules.file_ingestion import FileIngestionModule
-from app.modules.llm_query import LLMQueryModule
+from app.modules.llm_query import LLMQueryError, LLMQueryModule
 from app.modules.visualization import VisualizationModule
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release shared network clients on shutdown."""
+    yield
+    await llm_query.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Data Copilot API",
     description="Backend API for AI-powered data analysis and visualization",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS middleware for Streamlit frontend
@@ -29,18 +46,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON bodies (chart arrays, sample rows); tiny responses are not worth it.
+# Compression runs on the event loop, so use a mid level rather than the default 9.
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+
+# Chunk size for streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+MAX_UPLOAD_BYTES = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+
 # Initialize modules
-file_ingestion = FileIngestionModule(settings.UPLOAD_DIR)
-llm_query = LLMQueryModule(settings.OPENAI_API_KEY, settings.OPENAI_MODEL)
+file_ingestion = FileIngestionModule(settings.UPLOAD_DIR, settings.MAX_CACHE_MB * 1024 * 1024)
+llm_query = LLMQueryModule(
+    settings.OPENAI_API_KEY,
+    settings.OPENAI_MODEL,
+    cache_dir=settings.LLM_CACHE_DIR,
+    cache_ttl=settings.LLM_CACHE_TTL_SECONDS,
+    timeout=settings.LLM_TIMEOUT_SECONDS,
+    max_retries=settings.LLM_MAX_RETRIES
+)
 visualization = VisualizationModule()
 
 # Simple API key authentication
+_API_KEY_BYTES = settings.API_KEY.encode("utf-8")
+
 async def verify_api_key(x_api_key: Optional[str] = Header(None)):
     """
-    Simple API key verification.
+    Simple API key verification using a constant-time comparison.
     Extensible to OAuth2/JWT for production.
     """
-    if x_api_key != settings.API_KEY:
+    if not x_api_key or not hmac.compare_digest(x_api_key.encode("utf-8"), _API_KEY_BYTES):
         raise HTTPException(status_code=403, detail="Invalid API key")
     return x_api_key
 
@@ -49,51 +83,125 @@ async def root():
     """Health check endpoint"""
     return {"status": "online", "service": "AI Data Copilot API"}
 
-@app.post("/upload", response_model=FileUploadResponse)
-async def upload_file(
-    file: UploadFile = File(...),
-    api_key: str = Depends(verify_api_key)
-):
-    """
-    Upload CSV/Excel file and extract schema + summary.
-    
-    Returns:
-        - file_id: Unique identifier for the uploaded file
-        - schema: Column names and data types
-        - summary: Statistical summary
-        - sample_rows: First 5 rows
-    """
-    # Validate file extension
-    file_ext = Path(file.filename).suffix.lower()
+def _validate_extension(filename: str) -> str:
+    """Return the lower-cased extension or reject unsupported file types."""
+    file_ext = Path(filename).suffix.lower()
     if file_ext not in settings.ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail=f"File type not supported. Allowed: {settings.ALLOWED_EXTENSIONS}"
         )
+    return file_ext
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE_MB} MB"
+    )
+
+async def _ingest_upload(chunks: AsyncIterator[bytes], filename: str) -> FileUploadResponse:
+    """Write streamed chunks to a temp file, then ingest it off the event loop."""
+    file_ext = _validate_extension(filename)
     
-    # Save uploaded file temporarily
-    temp_path = Path(settings.UPLOAD_DIR) / f"temp_{file.filename}"
+    # Save uploaded file temporarily (unique name: uploads may run concurrently)
+    temp_path = Path(settings.UPLOAD_DIR) / f"temp_{uuid.uuid4().hex}{file_ext}"
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Write in chunks without blocking the event loop, stopping at the size limit
+        written = 0
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            async for chunk in chunks:
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise _too_large()
+                await buffer.write(chunk)
         
-        # Ingest and process file
-        file_id, metadata = file_ingestion.ingest_file(str(temp_path), file.filename)
+        # Ingest and process file off the event loop (pandas parse is blocking)
+        file_id, metadata = await asyncio.to_thread(
+            file_ingestion.ingest_file, str(temp_path), filename
+        )
         
         # Clean up temp file
         temp_path.unlink()
         
         return FileUploadResponse(**metadata)
         
+    except HTTPException:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
     except Exception as e:
         # Clean up on error
         if temp_path.exists():
             temp_path.unlink()
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+async def _read_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+@app.post("/upload", response_model=FileUploadResponse)
+async def upload_file(
+    file: UploadFile = File(...),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Upload CSV/Excel file and extract schema + summary.
+    
+    Returns:
+        - file_id: Unique identifier for the uploaded file
+        - schema: Column names and data types
+        - summary: Statistical summary
+        - sample_rows: First 5 rows
+    """
+    return await _ingest_upload(_read_upload(file), file.filename)
+
+@app.post("/upload/stream", response_model=FileUploadResponse)
+async def upload_file_stream(
+    request: Request,
+    x_filename: str = Header(..., description="URL-encoded original filename"),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Upload a file as a raw application/octet-stream body.
+    Avoids multipart parsing and spooling for large files; the body is
+    written to disk as it arrives. Returns the same payload as /upload.
+    """
+    # Reject a declared oversized body before reading any of it
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise _too_large()
+    filename = Path(unquote(x_filename)).name
+    return await _ingest_upload(request.stream(), filename)
+
+async def _sse_events(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    Encode (event, data) pairs as server-sent events.
+    The "result" payload goes through QueryResponse like the JSON response;
+    one that does not fit is replaced by an "error" event.
+    """
+    async for event, data in events:
+        if event == "result":
+            try:
+                data = QueryResponse(**data).model_dump()
+            except ValidationError as e:
+                event, data = "error", {"detail": f"Error processing query: {str(e)}", "status_code": 502}
+        yield b"event: " + event.encode("utf-8") + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+def _sse_response(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_events(events),
+        media_type="text/event-stream",
+        # An explicit encoding keeps GZipMiddleware from buffering the events
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"}
+    )
+
+async def _cached_events(result: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    yield "result", result
+
 @app.post("/query", response_model=QueryResponse)
 async def query_data(
     request: QueryRequest,
+    stream: bool = Query(False, description="Stream the answer as server-sent events"),
     api_key: str = Depends(verify_api_key)
 ):
     """
@@ -104,22 +212,46 @@ async def query_data(
         - chart_type: Suggested visualization type
         - chart_data: Structured data for chart rendering
         - recommendations: Actionable insights
+    
+    With ?stream=1 the response is text/event-stream: "delta" events carry
+    the answer text as it is generated, and a final "result" event carries
+    the validated response above (or an "error" event with a detail message
+    and the status code the JSON path would have returned).
     """
     try:
-        # Retrieve dataframe and metadata
-        df = file_ingestion.get_dataframe(request.file_id)
-        metadata = file_ingestion.get_metadata(request.file_id)
+        metadata = await asyncio.to_thread(file_ingestion.get_metadata, request.file_id)
         
-        # Process query with LLM
-        result = llm_query.process_query(
+        # Repeat questions are answered from the response cache before any
+        # frame is loaded
+        if not request.force_refresh:
+            cached = await llm_query.get_cached(request.file_id, request.question, metadata["schema"])
+            if cached is not None:
+                return _sse_response(_cached_events(cached)) if stream else QueryResponse(**cached)
+        
+        # The prompt only needs schema, summary and a few sample rows, all of
+        # which the metadata already holds, so no frame is loaded. The sample
+        # is projected to the columns the question names.
+        query_args = dict(
+            file_id=request.file_id,
             question=request.question,
-            df=df,
             schema=metadata["schema"],
-            summary=metadata["summary"]
+            summary=metadata["summary"],
+            sample_rows=metadata["sample_rows"],
+            columns=llm_query.select_columns(request.question, metadata["schema"])
         )
         
+        if stream:
+            return _sse_response(llm_query.process_query_stream(**query_args))
+        
+        # Process query with LLM (async, so the event loop stays free)
+        result = await llm_query.process_query(**query_args)
+        
         return QueryResponse(**result)
         
+    except LLMQueryError as e:
+        # Upstream failure: a real error status, so clients neither cache nor
+        # mistake it for an answer (429 stays retryable)
+        raise HTTPException(status_code=e.status_code, detail=f"Error processing query: {str(e)}")
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -144,5 +276,9 @@ if __name__ == "__main__":
         "app.main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=True
+        workers=settings.WORKERS,
+        reload=settings.RELOAD,
+        # uvloop is POSIX-only; fall back to the stdlib loop on Windows
+        loop="uvloop" if sys.platform != "win32" else "asyncio",
+        http="httptools"
     )
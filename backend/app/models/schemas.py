@@ -16,6 +16,7 @@ class QueryRequest(BaseModel):
     """Request model for natural language query"""
     file_id: str
     question: str = Field(..., min_length=1, description="Natural language question about the data")
+    force_refresh: bool = Field(False, description="Bypass the cached answer and query the LLM again")
 
 class ChartData(BaseModel):
     """Structured chart data"""
@@ -0,0 +1,95 @@
+# Module for size-bounded in-memory caching of processed dataframes
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import pandas as pd
+
+class DataFrameCache:
+    """
+    Byte-bounded 2Q cache for dataframes keyed by file_id.
+    New entries start in a FIFO probation queue (A1in); hits there do not
+    promote, since an upload and its first queries are one correlated burst.
+    Keys evicted from probation are remembered in a ghost queue (A1out),
+    and only a file reloaded while still remembered enters the main LRU
+    queue (Am), where one-shot uploads cannot push it out.
+    """
+
+    def __init__(self, max_bytes: int, probation_ratio: float = 0.25, ghost_entries: int = 256):
+        self.max_bytes = max_bytes
+        self.probation_bytes = int(max_bytes * probation_ratio)
+        self.ghost_entries = ghost_entries
+        self._a1in: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._am: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._a1out: "OrderedDict[str, None]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._a1in_bytes = 0
+        self._total_bytes = 0
+        self._lock = threading.Lock()  # Accessed from asyncio.to_thread workers
+
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self._sizes
+
+    def get(self, file_id: str) -> Optional[pd.DataFrame]:
+        """
+        Return the cached dataframe or None, updating its queue position.
+        """
+        with self._lock:
+            if file_id in self._am:
+                self._am.move_to_end(file_id)
+                return self._am[file_id]
+            # Probation hits leave the FIFO order alone
+            return self._a1in.get(file_id)
+
+    def put(self, file_id: str, df: pd.DataFrame) -> None:
+        """
+        Insert a dataframe, evicting older entries until the cache fits.
+        Frames larger than the whole budget are not cached.
+        """
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            self._remove(file_id)
+            if size > self.max_bytes:
+                return
+
+            self._sizes[file_id] = size
+            self._total_bytes += size
+            if file_id in self._a1out:
+                # Recently evicted from probation, so it has been reused
+                del self._a1out[file_id]
+                self._am[file_id] = df
+            else:
+                self._a1in[file_id] = df
+                self._a1in_bytes += size
+            self._evict_overflow()
+
+    def evict(self, file_id: str) -> None:
+        """
+        Drop an entry, e.g. when its parquet file is rewritten.
+        """
+        with self._lock:
+            self._remove(file_id)
+            self._a1out.pop(file_id, None)
+
+    def _remove(self, file_id: str) -> None:
+        size = self._sizes.pop(file_id, None)
+        if size is None:
+            return
+        self._total_bytes -= size
+        if self._a1in.pop(file_id, None) is not None:
+            self._a1in_bytes -= size
+        else:
+            self._am.pop(file_id, None)
+
+    def _evict_overflow(self) -> None:
+        while self._total_bytes > self.max_bytes:
+            if self._a1in and (self._a1in_bytes > self.probation_bytes or not self._am):
+                file_id, _ = self._a1in.popitem(last=False)
+                size = self._sizes.pop(file_id)
+                self._a1in_bytes -= size
+                self._total_bytes -= size
+                self._a1out[file_id] = None
+                if len(self._a1out) > self.ghost_entries:
+                    self._a1out.popitem(last=False)
+            else:
+                file_id, _ = self._am.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(file_id)
@@ -1,10 +1,54 @@
 # Module for file upload, cleaning, schema extraction, and summary generation
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+import datetime
+import threading
 import uuid
 import json
+import orjson
+
+from app.modules.dataframe_cache import DataFrameCache
+
+# Parquet key-value metadata entry holding schema, summary and sample rows
+PARQUET_METADATA_KEY = b"ai_data_copilot.metadata"
+
+# Schema type names by NumPy/pandas dtype kind
+_DTYPE_KIND_NAMES = {
+    'i': 'integer',
+    'u': 'integer',
+    'f': 'float',
+    'M': 'datetime',
+    'b': 'boolean',
+}
+
+# Frames stay NumPy-backed so the object/number dtype logic below holds.
+def _read_csv(file_path: str) -> pd.DataFrame:
+    # pyarrow parses CSV columns in parallel. It rejects ragged rows and
+    # keeps duplicate headers as-is, so those files are re-read with the
+    # C parser, which pads short rows with NaN and renames duplicates a.1.
+    try:
+        df = pd.read_csv(file_path, engine="pyarrow")
+    except pd.errors.ParserError:
+        return pd.read_csv(file_path)
+    if df.columns.duplicated().any():
+        return pd.read_csv(file_path)
+    # Arrow infers date-only columns as date32, which pandas hands back as
+    # object columns of datetime.date; store them as datetime64 instead.
+    # Arrow columns are homogeneous, so the first value decides.
+    for col in df.select_dtypes(include=['object']).columns:
+        first = df[col].first_valid_index()
+        if first is not None and isinstance(df[col].at[first], datetime.date):
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+def _read_excel(file_path: str) -> pd.DataFrame:
+    # calamine is a native Excel reader that also handles legacy .xls files
+    return pd.read_excel(file_path, engine="calamine")
 
 class FileIngestionModule:
     """
@@ -13,10 +57,21 @@ class FileIngestionModule:
     Designed to be extended to PySpark for larger files.
     """
     
-    def __init__(self, upload_dir: str):
+    # File extension -> reader; add new formats here
+    _READERS = {
+        ".csv": _read_csv,
+        ".xlsx": _read_excel,
+        ".xls": _read_excel,
+    }
+    
+    def __init__(self, upload_dir: str, max_cache_bytes: int = 512 * 1024 * 1024):
         self.upload_dir = Path(upload_dir)
         self.upload_dir.mkdir(exist_ok=True)
-        self.data_cache: Dict[str, pd.DataFrame] = {}  # In-memory cache for MVP
+        self.data_cache = DataFrameCache(max_cache_bytes)  # Bounded in-memory cache
+        # Small LRU of metadata dicts so queries skip the disk entirely
+        self.metadata_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.max_metadata_entries = 1024
+        self._metadata_lock = threading.Lock()
     
     def ingest_file(self, file_path: str, original_filename: str) -> Tuple[str, Dict[str, Any]]:
         """
@@ -26,28 +81,22 @@ class FileIngestionModule:
         file_id = str(uuid.uuid4())
         
         # Read file based on extension
-        if original_filename.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif original_filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
+        reader = self._READERS.get(Path(original_filename).suffix.lower())
+        if reader is None:
             raise ValueError(f"Unsupported file format: {original_filename}")
+        df = reader(file_path)
         
         # Clean data: handle missing values, strip whitespace
         df = self._clean_dataframe(df)
         
         # Cache dataframe for future queries
-        self.data_cache[file_id] = df
+        self.data_cache.put(file_id, df)
         
         # Extract schema and summary
         schema = self._extract_schema(df)
         summary = self._generate_summary(df)
         sample_rows = self._get_sample_rows(df, n=5)
         
-        # Save processed dataframe for persistence
-        processed_path = self.upload_dir / f"{file_id}.parquet"
-        df.to_parquet(processed_path, index=False)
-        
         metadata = {
             "file_id": file_id,
             "filename": original_filename,
@@ -58,10 +107,29 @@ class FileIngestionModule:
             "column_count": len(df.columns)
         }
         
-        # Save metadata
-        metadata_path = self.upload_dir / f"{file_id}_metadata.json"
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2, default=str)
+        # Save processed dataframe for persistence, with the metadata stored
+        # in the parquet footer so a single file holds everything
+        processed_path = self.upload_dir / f"{file_id}.parquet"
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            PARQUET_METADATA_KEY: orjson.dumps(
+                metadata,
+                default=str,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+        })
+        # Zstd + dictionary encoding keeps files small; 64k-row groups let
+        # column-projected reads skip most of the file
+        pq.write_table(
+            table,
+            processed_path,
+            compression="zstd",
+            compression_level=3,
+            row_group_size=65536,
+            use_dictionary=True
+        )
+        self._cache_metadata(file_id, metadata)
         
         return file_id, metadata
     
@@ -73,12 +141,15 @@ class FileIngestionModule:
         # Strip whitespace from column names
         df.columns = df.columns.str.strip()
         
-        # Strip whitespace from string columns
+        # Strip whitespace from string columns and replace empty strings with NaN.
+        # Only object columns can hold strings, so numeric columns are skipped.
         for col in df.select_dtypes(include=['object']).columns:
-            df[col] = df[col].str.strip() if df[col].dtype == 'object' else df[col]
-        
-        # Replace empty strings with NaN
-        df.replace(r'^\s*$', np.nan, regex=True, inplace=True)
+            try:
+                stripped = df[col].str.strip()
+            except AttributeError:
+                # Object column without strings (e.g. all booleans with gaps)
+                continue
+            df[col] = stripped.mask(stripped == '', np.nan)
         
         return df
     
@@ -86,21 +157,8 @@ class FileIngestionModule:
         """
         Extract column names and their data types.
         """
-        schema = {}
-        for col in df.columns:
-            dtype = str(df[col].dtype)
-            # Simplify dtype names
-            if 'int' in dtype:
-                schema[col] = 'integer'
-            elif 'float' in dtype:
-                schema[col] = 'float'
-            elif 'datetime' in dtype:
-                schema[col] = 'datetime'
-            elif 'bool' in dtype:
-                schema[col] = 'boolean'
-            else:
-                schema[col] = 'string'
-        return schema
+        # Simplify dtype names by dtype kind; anything unlisted is a string
+        return {col: _DTYPE_KIND_NAMES.get(dtype.kind, 'string') for col, dtype in df.dtypes.items()}
     
     def _generate_summary(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
@@ -112,62 +170,96 @@ class FileIngestionModule:
             "missing_values": {}
         }
         
-        # Numeric summary
+        # Numeric summary: one describe() pass instead of five scans per column
         numeric_cols = df.select_dtypes(include=[np.number]).columns
-        for col in numeric_cols:
-            summary["numeric_columns"][col] = {
-                "mean": float(df[col].mean()),
-                "median": float(df[col].median()),
-                "min": float(df[col].min()),
-                "max": float(df[col].max()),
-                "std": float(df[col].std())
-            }
+        if len(numeric_cols) > 0:
+            stats = df[numeric_cols].describe().T
+            for col, row in stats.iterrows():
+                summary["numeric_columns"][col] = {
+                    "mean": float(row["mean"]),
+                    "median": float(row["50%"]),
+                    "min": float(row["min"]),
+                    "max": float(row["max"]),
+                    "std": float(row["std"])
+                }
         
         # Categorical summary
         categorical_cols = df.select_dtypes(include=['object']).columns
         for col in categorical_cols:
-            value_counts = df[col].value_counts().head(10).to_dict()
+            # Unsorted counts + top-k selection avoids sorting every unique value;
+            # the count index also gives the (NaN-excluding) unique count
+            counts = df[col].value_counts(sort=False)
+            top_values = counts.nlargest(10)
             summary["categorical_columns"][col] = {
-                "unique_count": int(df[col].nunique()),
-                "top_values": {str(k): int(v) for k, v in value_counts.items()}
+                "unique_count": len(counts),
+                "top_values": {str(k): int(v) for k, v in top_values.items()}
             }
         
         # Missing values
-        for col in df.columns:
-            missing = int(df[col].isna().sum())
-            if missing > 0:
-                summary["missing_values"][col] = missing
+        missing = df.isna().sum()
+        summary["missing_values"] = {col: int(n) for col, n in missing[missing > 0].items()}
         
         return summary
     
     def _get_sample_rows(self, df: pd.DataFrame, n: int = 5) -> list:
         """
         Get sample rows from the dataframe.
+        Arrow's columnar-to-row conversion runs in C++ and maps NaN to None.
         """
-        return df.head(n).to_dict(orient='records')
+        return pa.Table.from_pandas(df.head(n), preserve_index=False).to_pylist()
     
-    def get_dataframe(self, file_id: str) -> pd.DataFrame:
+    def get_dataframe(self, file_id: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Retrieve cached dataframe or load from disk.
+        If columns is given, only those columns are returned (and read).
         """
-        if file_id in self.data_cache:
-            return self.data_cache[file_id]
+        df = self.data_cache.get(file_id)
+        if df is not None:
+            return df[columns] if columns else df
         
-        # Load from disk
+        # Load from disk; memory-mapping lets the OS page cache serve repeat reads
         parquet_path = self.upload_dir / f"{file_id}.parquet"
         if parquet_path.exists():
-            df = pd.read_parquet(parquet_path)
-            self.data_cache[file_id] = df
+            df = pq.read_table(parquet_path, columns=columns, memory_map=True).to_pandas()
+            # Only full frames are cached; projected reads are cheap to repeat
+            if columns is None:
+                self.data_cache.put(file_id, df)
             return df
         
         raise ValueError(f"File ID {file_id} not found")
     
     def get_metadata(self, file_id: str) -> Dict[str, Any]:
         """
-        Retrieve file metadata.
+        Retrieve file metadata from memory, the parquet footer, or the
+        JSON sidecar written by older versions.
         """
-        metadata_path = self.upload_dir / f"{file_id}_metadata.json"
-        if metadata_path.exists():
+        with self._metadata_lock:
+            metadata = self.metadata_cache.get(file_id)
+            if metadata is not None:
+                self.metadata_cache.move_to_end(file_id)
+                return metadata
+        
+        metadata = None
+        parquet_path = self.upload_dir / f"{file_id}.parquet"
+        if parquet_path.exists():
+            kv_metadata = pq.read_schema(parquet_path).metadata or {}
+            if PARQUET_METADATA_KEY in kv_metadata:
+                metadata = orjson.loads(kv_metadata[PARQUET_METADATA_KEY])
+        
+        if metadata is None:
+            metadata_path = self.upload_dir / f"{file_id}_metadata.json"
+            if not metadata_path.exists():
+                raise ValueError(f"Metadata for file ID {file_id} not found")
+            # Stdlib json: legacy sidecars may contain NaN, which orjson rejects
             with open(metadata_path, 'r') as f:
-                return json.load(f)
-        raise ValueError(f"Metadata for file ID {file_id} not found")
+                metadata = json.load(f)
+        
+        self._cache_metadata(file_id, metadata)
+        return metadata
+    
+    def _cache_metadata(self, file_id: str, metadata: Dict[str, Any]) -> None:
+        with self._metadata_lock:
+            self.metadata_cache[file_id] = metadata
+            self.metadata_cache.move_to_end(file_id)
+            if len(self.metadata_cache) > self.max_metadata_entries:
+                self.metadata_cache.popitem(last=False)
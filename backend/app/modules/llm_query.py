@@ -1,52 +1,263 @@
+import asyncio
 import openai
 import httpx
-import json
-import pandas as pd
-from typing import Dict, Any
+import orjson
+import hashlib
+import re
+import diskcache
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+from app.models.schemas import QueryResponse
+
+class LLMQueryError(Exception):
+    """
+    The LLM call failed or returned an unusable reply.
+    status_code is the HTTP status the API reports for it.
+    """
+    
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _AnswerTextStream:
+    """
+    Incrementally decodes the "answer_text" string value from a JSON
+    object that arrives in chunks, so stream deltas carry readable text
+    rather than raw JSON fragments. The raw reply accumulates in .raw.
+    """
+    
+    _KEY = re.compile(r'"answer_text"\s*:\s*"')
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    
+    def __init__(self):
+        self.raw = ""
+        self._pos: Optional[int] = None  # Next undecoded index inside the value
+        self._done = False
+    
+    def feed(self, chunk: str) -> str:
+        """Add a chunk; returns the newly decoded answer text (may be empty)."""
+        self.raw += chunk
+        if self._done:
+            return ""
+        if self._pos is None:
+            match = self._KEY.search(self.raw)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        
+        raw, i, out = self.raw, self._pos, []
+        while i < len(raw):
+            ch = raw[i]
+            if ch == '"':
+                self._done = True
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            # Escapes may be split across chunks; wait for the rest
+            if i + 1 >= len(raw):
+                break
+            if raw[i + 1] != 'u':
+                out.append(self._ESCAPES.get(raw[i + 1], raw[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(raw):
+                break
+            code = int(raw[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # High surrogate: needs the \uXXXX low half that follows
+                if i + 12 > len(raw):
+                    break
+                low = int(raw[i + 8:i + 12], 16)
+                code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                i += 6
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        return "".join(out)
 
 class LLMQueryModule:
-    def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
+    SYSTEM_PROMPT = """You are DataCopilot, an AI assistant specialized in analyzing tabular data.
+Always respond with valid JSON containing: answer_text, chart_type, chart_data, recommendations, sql_query."""
+    
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini",
+                 cache_dir: Optional[str] = None, cache_ttl: int = 24 * 60 * 60,
+                 timeout: float = 45.0, max_retries: int = 2):
         self.api_key = api_key
         self.model = model
-        self.client = openai.OpenAI(
+        # Validated responses keyed by file, question and schema; shared
+        # across processes. Disabled when no cache_dir is given.
+        self.cache = diskcache.Cache(cache_dir) if cache_dir else None
+        self.cache_ttl = cache_ttl
+        # Prebuilt schema + sample prompt context per (file_id, columns)
+        self.prompt_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], str]" = OrderedDict()
+        self.max_prompt_entries = 256
+        # One pooled HTTP/2 client shared by all requests so concurrent
+        # queries multiplex over reused TLS connections
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        self.client = openai.AsyncOpenAI(
             api_key=api_key,
-            timeout=httpx.Timeout(60.0, connect=10.0),
-            max_retries=3
+            http_client=self.http_client,
+            max_retries=max_retries
         )
     
-    def process_query(self, question: str, df: pd.DataFrame, schema: Dict[str, str], summary: Dict[str, Any]) -> Dict[str, Any]:
-        system_prompt = self._build_system_prompt()
-        user_prompt = self._build_user_prompt(question, df, schema, summary)
-        
+    async def aclose(self) -> None:
+        """Close the shared HTTP client and the response cache."""
+        await self.client.close()
+        if self.cache is not None:
+            self.cache.close()
+    
+    async def process_query(self, file_id: str, question: str, schema: Dict[str, str],
+                            summary: Dict[str, Any], sample_rows: List[Dict[str, Any]],
+                            columns: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Ask the LLM and cache the validated answer. Callers check
+        get_cached first, before loading the frame.
+        """
+        cache_key = self._cache_key(file_id, question, schema)
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=self._build_messages(file_id, question, schema, summary, sample_rows, columns),
                 temperature=0.3,
                 response_format={"type": "json_object"}
             )
-            result = json.loads(response.choices[0].message.content)
-            return self._validate_response(result)
+            return await self._finalize(response.choices[0].message.content, cache_key)
         except Exception as e:
-            return {
-                "answer_text": f"Error: {str(e)}",
-                "chart_type": None,
-                "chart_data": None,
-                "recommendations": None,
-                "sql_query": None
-            }
-    
-    def _build_system_prompt(self) -> str:
-        return """You are DataCopilot, an AI assistant specialized in analyzing tabular data.
-Always respond with valid JSON containing: answer_text, chart_type, chart_data, recommendations, sql_query."""
+            raise self._query_error(e) from e
+    
+    async def process_query_stream(self, file_id: str, question: str, schema: Dict[str, str],
+                                   summary: Dict[str, Any], sample_rows: List[Dict[str, Any]],
+                                   columns: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream the answer_text value as ("delta", {"text": ...}) events as
+        tokens arrive (decoded text, not raw JSON), followed by a single ("result", response) event holding the
+        validated response (the same dict process_query returns), or an
+        ("error", {"detail", "status_code"}) event if the query failed.
+        """
+        cache_key = self._cache_key(file_id, question, schema)
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_messages(file_id, question, schema, summary, sample_rows, columns),
+                temperature=0.3,
+                response_format={"type": "json_object"},
+                stream=True
+            )
+            answer = _AnswerTextStream()
+            async with stream:
+                async for chunk in stream:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        text = answer.feed(content)
+                        if text:
+                            yield "delta", {"text": text}
+            result = await self._finalize(answer.raw, cache_key)
+        except Exception as e:
+            error = self._query_error(e)
+            yield "error", {"detail": str(error), "status_code": error.status_code}
+            return
+        yield "result", result
+    
+    def _build_messages(self, file_id: str, question: str, schema: Dict[str, str],
+                        summary: Dict[str, Any], sample_rows: List[Dict[str, Any]],
+                        columns: Optional[List[str]]) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_user_prompt(file_id, question, schema, summary, sample_rows, columns)}
+        ]
+    
+    async def get_cached(self, file_id: str, question: str, schema: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached answer for this question, or None.
+        diskcache is blocking SQLite I/O, so it runs off the event loop.
+        """
+        if self.cache is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, self._cache_key(file_id, question, schema))
+    
+    async def _finalize(self, content: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Parse and validate the model's JSON reply, caching successful answers.
+        Replies that do not fit QueryResponse raise here, before caching.
+        """
+        validated = self._validate_response(orjson.loads(content))
+        validated = QueryResponse(**validated).model_dump()
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, cache_key, validated, expire=self.cache_ttl)
+        return validated
+    
+    @staticmethod
+    def _query_error(error: Exception) -> LLMQueryError:
+        """
+        Map a failure to an LLMQueryError; rate limits and timeouts keep
+        their own status so clients can retry them.
+        """
+        if isinstance(error, openai.RateLimitError):
+            status_code = 429
+        elif isinstance(error, openai.APITimeoutError):
+            status_code = 504
+        else:
+            status_code = 502
+        return LLMQueryError(f"LLM query failed: {str(error)}", status_code)
+    
+    def _cache_key(self, file_id: str, question: str, schema: Dict[str, str]) -> str:
+        """
+        Build the response cache key from model, file, normalized question and schema.
+        """
+        normalized = re.sub(r"\s+", " ", question.strip().lower())
+        schema_str = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+        raw = "\x1f".join([self.model, file_id, normalized, schema_str])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def select_columns(question: str, schema: Dict[str, str]) -> Optional[List[str]]:
+        """
+        Pick the schema columns mentioned in the question as whole words.
+        Returns None (use all columns) when no column name matches.
+        """
+        question = question.lower()
+        columns = []
+        for col in schema:
+            name = col.lower()
+            if not any(
+                re.search(rf"(?<!\w){re.escape(candidate)}(?!\w)", question)
+                for candidate in {name, name.replace("_", " ")}
+            ):
+                continue
+            if len(name) < 2:
+                # One-letter names ("a", "x") also match ordinary words, so the
+                # question cannot be safely projected; keep every column
+                return None
+            columns.append(col)
+        return columns or None
     
-    def _build_user_prompt(self, question: str, df: pd.DataFrame, schema: Dict[str, str], summary: Dict[str, Any]) -> str:
-        schema_str = "\n".join([f"  - {col}: {dtype}" for col, dtype in schema.items()])
-        sample_rows = df.head(3).to_dict(orient='records')
-        return f"""Schema:\n{schema_str}\n\nSample Data:\n{json.dumps(sample_rows, default=str)}\n\nQuestion: {question}"""
+    def _build_user_prompt(self, file_id: str, question: str, schema: Dict[str, str],
+                           summary: Dict[str, Any], sample_rows: List[Dict[str, Any]],
+                           columns: Optional[List[str]] = None) -> str:
+        # Schema and sample rows only change per file (and column projection)
+        key = (file_id, tuple(columns or ()))
+        context = self.prompt_cache.get(key)
+        if context is None:
+            schema_str = "\n".join([f"  - {col}: {dtype}" for col, dtype in schema.items()])
+            # The upload's stored sample rows stand in for the frame
+            sample = sample_rows[:3]
+            if columns:
+                sample = [{col: row.get(col) for col in columns} for row in sample]
+            sample_str = orjson.dumps(sample, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            context = f"""Schema:\n{schema_str}\n\nSample Data:\n{sample_str}"""
+            self.prompt_cache[key] = context
+            if len(self.prompt_cache) > self.max_prompt_entries:
+                self.prompt_cache.popitem(last=False)
+        else:
+            self.prompt_cache.move_to_end(key)
+        return f"""{context}\n\nQuestion: {question}"""
     
     def _validate_response(self, result: Dict[str, Any]) -> Dict[str, Any]:
         """
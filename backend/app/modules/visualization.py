@@ -13,11 +13,12 @@ class VisualizationModule:
         """
         Prepare data for bar chart.
         """
-        # Aggregate if necessary
+        # Aggregate if necessary: unsorted hash groupby + top-k selection
+        # instead of sorting every group key
         if df[y_col].dtype in ['int64', 'float64']:
-            data = df.groupby(x_col)[y_col].sum().head(limit)
+            data = df.groupby(x_col, sort=False)[y_col].sum().nlargest(limit)
         else:
-            data = df[x_col].value_counts().head(limit)
+            data = df[x_col].value_counts(sort=False).nlargest(limit)
         
         return {
             "labels": data.index.tolist(),
@@ -47,7 +48,7 @@ class VisualizationModule:
         """
         Prepare data for pie chart.
         """
-        data = df[column].value_counts().head(limit)
+        data = df[column].value_counts(sort=False).nlargest(limit)
         
         return {
             "labels": data.index.tolist(),
@@ -62,7 +63,11 @@ class VisualizationModule:
         """
         Prepare data for scatter plot.
         """
-        data = df[[x_col, y_col]].dropna().head(limit)
+        # Random sample rather than the first rows so the plot reflects the
+        # whole distribution; fixed seed keeps the chart stable across calls
+        data = df[[x_col, y_col]].dropna()
+        if len(data) > limit:
+            data = data.sample(n=limit, random_state=0)
         
         return {
             "x_column": x_col,
@@ -0,0 +1,52 @@
+# Tests for the 2Q dataframe cache
+import numpy as np
+import pandas as pd
+
+from app.modules.dataframe_cache import DataFrameCache
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({"value": np.arange(1000, dtype=np.int64)})
+
+def _frame_bytes() -> int:
+    return int(_frame().memory_usage(deep=True).sum())
+
+def _load(cache: DataFrameCache, file_id: str) -> pd.DataFrame:
+    """Mirror get_dataframe: serve from cache, else reload and put"""
+    df = cache.get(file_id)
+    if df is None:
+        df = _frame()
+        cache.put(file_id, df)
+    return df
+
+def test_probation_hits_do_not_promote():
+    cache = DataFrameCache(4 * _frame_bytes())
+    cache.put("hot", _frame())
+    for _ in range(20):
+        assert cache.get("hot") is not None
+    
+    # Still in probation, so one-off uploads push it out like any other
+    for i in range(4):
+        cache.put(f"once-{i}", _frame())
+        cache.get(f"once-{i}")
+    assert "hot" not in cache
+
+def test_queried_file_survives_one_off_uploads():
+    cache = DataFrameCache(4 * _frame_bytes())
+    cache.put("hot", _frame())
+    cache.get("hot")
+    for i in range(4):
+        cache.put(f"warmup-{i}", _frame())
+    
+    # Reloaded while remembered in the ghost queue: admitted to the main queue
+    assert "hot" not in cache
+    _load(cache, "hot")
+    
+    for i in range(20):
+        cache.put(f"once-{i}", _frame())
+        cache.get(f"once-{i}")
+        assert cache.get("hot") is not None
+
+def test_oversized_frame_is_not_cached():
+    cache = DataFrameCache(_frame_bytes() - 1)
+    cache.put("big", _frame())
+    assert "big" not in cache
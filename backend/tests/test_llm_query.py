@@ -0,0 +1,23 @@
+# Tests for streaming answer_text extraction
+import json
+
+from app.modules.llm_query import _AnswerTextStream
+
+def _feed(raw: str, size: int) -> str:
+    stream = _AnswerTextStream()
+    text = "".join(stream.feed(raw[i:i + size]) for i in range(0, len(raw), size))
+    assert stream.raw == raw
+    return text
+
+def test_decodes_answer_text_across_chunk_boundaries():
+    reply = {
+        "chart_type": "bar",
+        "answer_text": 'Sales rose "12%"\n\\ café \U0001F600',
+        "chart_data": {"answer_text": "nested"},
+    }
+    for raw in (json.dumps(reply), json.dumps(reply, ensure_ascii=False)):
+        for size in range(1, 8):
+            assert _feed(raw, size) == reply["answer_text"]
+
+def test_no_answer_text_yields_nothing():
+    assert _feed('{"chart_type": "none"}', 3) == ""
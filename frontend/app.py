@@ -1,20 +1,36 @@
 # Streamlit frontend for AI Data Copilot
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from typing import Optional, Dict, Any
+import numpy as np
+from typing import TYPE_CHECKING, Optional, Dict, Any
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-import tempfile
+import uuid
+from urllib.parse import quote
+from collections import OrderedDict
+import csv
+import orjson
+from xml.sax.saxutils import escape
+
+# Plotly and ReportLab are imported where they are used, so sessions that
+# never draw a chart or export a PDF don't pay for loading them
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
 
 # Configuration
 API_URL = "http://backend:8000"  # Docker service name
 API_KEY = "demo-api-key-change-in-production"  # Should match backend
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB per read/send when streaming uploads
+MAX_LINE_POINTS = 2000  # Line series longer than this are downsampled (LTTB)
+MAX_SCATTER_POINTS = 5000  # Scatter payloads larger than this are sampled
+QUERY_TIMEOUT = (5, 150)  # (connect, read): above the backend's 3 LLM attempts x 45 s
+STREAM_UPLOAD_THRESHOLD = 8 << 20  # Files above 8 MiB skip multipart and stream raw
+MAX_CACHED_CHARTS = 20  # Charts (payload or built figure) kept per session; older ones are dropped
+CSV_FIELDS = ["Question", "Answer", "Chart Type"]
+CHART_TYPES = {"bar", "line", "pie", "scatter"}  # Types _build_fig can render
 
 # Page configuration
 st.set_page_config(
@@ -45,6 +61,12 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def _new_csv_buffer() -> io.StringIO:
+    """CSV export buffer with the header row already written"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(CSV_FIELDS)
+    return buffer
+
 # Session state initialization
 if 'file_id' not in st.session_state:
     st.session_state.file_id = None
@@ -52,45 +74,122 @@ if 'metadata' not in st.session_state:
     st.session_state.metadata = None
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'chart_cache' not in st.session_state:
+    # chart_key -> chart_data; chat_history only holds the key
+    st.session_state.chart_cache = OrderedDict()
+if 'csv_buf' not in st.session_state:
+    # Export state is updated once per turn, so exports never rescan history
+    st.session_state.csv_buf = _new_csv_buffer()
+if 'pdf_version' not in st.session_state:
+    st.session_state.pdf_version = 0
+
+class LargeBlockAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections send request bodies in UPLOAD_CHUNK_SIZE
+    blocks instead of urllib3's 16 KiB default, so streamed uploads pull
+    from the encoder/file and hit the socket ~64x less often per MiB.
+    """
+    def init_poolmanager(self, *args, **pool_kwargs):
+        pool_kwargs.setdefault("blocksize", UPLOAD_CHUNK_SIZE)
+        super().init_poolmanager(*args, **pool_kwargs)
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Shared keep-alive HTTP session so reruns reuse pooled connections"""
+    session = requests.Session()
+    adapter = LargeBlockAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            raise_on_status=False  # Hand back the last response so callers see its detail
+        )
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # /query bodies are small and replayable, so unlike uploads they can
+    # also be retried on POST (and on rate limiting). Longest prefix wins.
+    # Read timeouts are not retried: the LLM call is still running on the
+    # backend. 502/504 are not either: the backend already retried the LLM
+    # and a resend would be billed again.
+    query_adapter = LargeBlockAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.3,
+            read=0,
+            allowed_methods=["POST"],
+            status_forcelist=[429, 503],
+            raise_on_status=False
+        )
+    )
+    session.mount(f"{API_URL}/query", query_adapter)
+    # Ask for gzip explicitly; the backend compresses JSON responses
+    session.headers.update({"X-API-Key": API_KEY, "Accept-Encoding": "gzip"})
+    return session
+
+def _iter_chunks(file, size: int = UPLOAD_CHUNK_SIZE):
+    """Yield the file in fixed-size chunks for a streamed request body"""
+    while chunk := file.read(size):
+        yield chunk
 
 def upload_file(file) -> Optional[Dict[str, Any]]:
-    """Upload file to backend API"""
-    files = {"file": (file.name, file, file.type)}
-    headers = {"X-API-Key": API_KEY}
+    """Upload file to backend API, streaming the body"""
+    file.seek(0)
+    if file.size > STREAM_UPLOAD_THRESHOLD:
+        # Large files: raw chunked body, no multipart encoding on either side
+        url = f"{API_URL}/upload/stream"
+        data = _iter_chunks(file)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Filename": quote(file.name)
+        }
+    else:
+        url = f"{API_URL}/upload"
+        data = MultipartEncoder(
+            fields={"file": (file.name, file, file.type or "application/octet-stream")}
+        )
+        headers = {"Content-Type": data.content_type}
     
     try:
-        response = requests.post(
-            f"{API_URL}/upload",
-            files=files,
+        response = get_session().post(
+            url,
+            data=data,
             headers=headers,
-            timeout=30
+            timeout=(5, 300)  # (connect, read): large files need time to process
         )
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     except Exception as e:
         st.error(f"Upload failed: {str(e)}")
         return None
 
-def query_data(file_id: str, question: str) -> Optional[Dict[str, Any]]:
-    """Send natural language query to backend"""
-    headers = {
-        "X-API-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def _cached_query(file_id: str, question: str) -> Dict[str, Any]:
+    """
+    POST /query; raises on failure so errors are never cached.
+    The backend reports LLM failures as 429/502/504, not as 200 answers.
+    """
     payload = {
         "file_id": file_id,
         "question": question
     }
-    
+    response = get_session().post(
+        f"{API_URL}/query",
+        data=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+        timeout=QUERY_TIMEOUT
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+def query_data(file_id: str, question: str) -> Optional[Dict[str, Any]]:
+    """Send natural language query to backend (repeat questions are served from cache)"""
     try:
-        response = requests.post(
-            f"{API_URL}/query",
-            json=payload,  # Use json= not data=
-            headers=headers,
-            timeout=60  # Increase timeout
-        )
-        response.raise_for_status()
-        return response.json()
+        return _cached_query(file_id, question.strip())
     except requests.exceptions.HTTPError as e:
         st.error(f"HTTP Error: {e.response.status_code} - {e.response.text}")
         return None
@@ -99,103 +198,338 @@ def query_data(file_id: str, question: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-def render_chart(chart_type: str, chart_data: Dict[str, Any]):
-    """Render chart using Plotly"""
-    if not chart_data or chart_type == "none":
-        return None
+def _lttb_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of n_out points that
+    keep the visual shape of the series. Point positions serve as x, so
+    string/categorical labels work too.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    x = np.arange(n, dtype=np.float64)
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
     
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Pick the point forming the largest triangle with the previous pick
+        # and the next bucket's average
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        indices[i + 1] = prev
+    return indices
+
+def _line_indices(datasets: list) -> Optional[np.ndarray]:
+    """Shared point indices for downsampling a long line chart, or None"""
+    first = datasets[0].get("data") or []
+    if len(first) <= MAX_LINE_POINTS:
+        return None
     try:
-        labels = chart_data.get("labels", [])
-        datasets = chart_data.get("datasets", [])
-        
-        if not datasets:
-            return None
+        return _lttb_indices(np.asarray(first, dtype=np.float64), MAX_LINE_POINTS)
+    except (TypeError, ValueError):
+        # Non-numeric series: fall back to an even stride
+        return np.linspace(0, len(first) - 1, MAX_LINE_POINTS).astype(np.int64)
+
+def _take(values: list, indices: Optional[np.ndarray]) -> list:
+    """Select indices from a list when its length matches the sampled series"""
+    if indices is None or len(values) <= indices[-1]:
+        return values
+    return [values[i] for i in indices]
+
+def _as_values(values: list):
+    """Series values as a float64 array, converted once for Plotly; the list if non-numeric"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return values
+
+def _as_labels(labels: list):
+    """Axis labels as an ndarray when they are numeric, otherwise unchanged"""
+    array = np.asarray(labels)
+    return array if array.dtype.kind in "iuf" else labels
+
+def _build_fig(chart_type: str, chart_data: Dict[str, Any]) -> Optional["go.Figure"]:
+    """Build the Plotly figure from a chart payload"""
+    import plotly.graph_objects as go
+    
+    labels = chart_data.get("labels") or []
+    datasets = chart_data.get("datasets", [])
+    
+    if not datasets:
+        return None
+    
+    if chart_type == "bar":
+        x = _as_labels(labels)
+        fig = go.Figure(data=[
+            go.Bar(name=ds.get("label", "Data"), x=x, y=_as_values(ds.get("data") or []))
+            for ds in datasets
+        ])
+        fig.update_layout(title="Bar Chart", xaxis_title="Categories", yaxis_title="Values")
         
-        if chart_type == "bar":
-            fig = go.Figure(data=[
-                go.Bar(name=ds.get("label", "Data"), x=labels, y=ds.get("data", []))
-                for ds in datasets
-            ])
-            fig.update_layout(title="Bar Chart", xaxis_title="Categories", yaxis_title="Values")
-            
-        elif chart_type == "line":
-            fig = go.Figure(data=[
-                go.Scatter(name=ds.get("label", "Data"), x=labels, y=ds.get("data", []), mode='lines+markers')
-                for ds in datasets
-            ])
-            fig.update_layout(title="Line Chart", xaxis_title="X-Axis", yaxis_title="Y-Axis")
-            
-        elif chart_type == "pie":
-            fig = go.Figure(data=[
-                go.Pie(labels=labels, values=datasets[0].get("data", []))
-            ])
-            fig.update_layout(title="Pie Chart")
-            
-        elif chart_type == "scatter":
-            data_points = datasets[0].get("data", [])
-            x_vals = [point["x"] for point in data_points]
-            y_vals = [point["y"] for point in data_points]
-            fig = go.Figure(data=[
-                go.Scatter(x=x_vals, y=y_vals, mode='markers')
-            ])
-            fig.update_layout(
-                title="Scatter Plot",
-                xaxis_title=chart_data.get("x_column", "X"),
-                yaxis_title=chart_data.get("y_column", "Y")
+    elif chart_type == "line":
+        # Bound the points shipped to the browser; all series share the
+        # indices so they stay aligned on the x axis
+        indices = _line_indices(datasets)
+        x = _as_labels(_take(labels, indices))
+        fig = go.Figure(data=[
+            go.Scatter(
+                name=ds.get("label", "Data"),
+                x=x,
+                y=_as_values(_take(ds.get("data") or [], indices)),
+                mode='lines+markers'
             )
+            for ds in datasets
+        ])
+        fig.update_layout(title="Line Chart", xaxis_title="X-Axis", yaxis_title="Y-Axis")
+        
+    elif chart_type == "pie":
+        fig = go.Figure(data=[
+            go.Pie(labels=labels, values=datasets[0].get("data", []))
+        ])
+        fig.update_layout(title="Pie Chart")
+        
+    elif chart_type == "scatter":
+        # One columnar pass over the points; WebGL rendering keeps dense
+        # scatters responsive in the browser
+        points = pd.DataFrame.from_records(datasets[0].get("data", []), columns=("x", "y"))
+        if len(points) > MAX_SCATTER_POINTS:
+            points = points.sample(n=MAX_SCATTER_POINTS, random_state=0)
+        fig = go.Figure(data=[
+            go.Scattergl(x=points["x"].to_numpy(), y=points["y"].to_numpy(), mode='markers')
+        ])
+        fig.update_layout(
+            title="Scatter Plot",
+            xaxis_title=chart_data.get("x_column", "X"),
+            yaxis_title=chart_data.get("y_column", "Y")
+        )
+    else:
+        return None
+    
+    return fig
+
+def _store_chart(chart_type: Optional[str], chart_data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Keep a chart payload in the bounded session chart cache; returns its key.
+    Entries are replaced by the built figure on first render. Turns without
+    a renderable chart type take no slot."""
+    if chart_type not in CHART_TYPES or not chart_data:
+        return None
+    chart_key = uuid.uuid4().hex
+    chart_cache = st.session_state.chart_cache
+    chart_cache[chart_key] = chart_data
+    while len(chart_cache) > MAX_CACHED_CHARTS:
+        chart_cache.popitem(last=False)
+    return chart_key
+
+def render_chart(chart_type: str, chart_key: Optional[str], key: Optional[str] = None):
+    """Render chart using Plotly"""
+    chart_cache = st.session_state.chart_cache
+    entry = chart_cache.get(chart_key)
+    if entry is None or chart_type == "none":
+        return None
+    
+    try:
+        if isinstance(entry, dict):
+            fig = _build_fig(chart_type, entry)
+            if fig is None:
+                return None
+            # Swap the payload for the live figure so reruns skip the build
+            # (no pickling or JSON re-parse; session state holds the object)
+            chart_cache[chart_key] = fig
         else:
-            return None
+            fig = entry
         
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, use_container_width=True, key=key)
         return fig
         
     except Exception as e:
         st.error(f"Error rendering chart: {str(e)}")
         return None
 
-def export_to_csv(chat_history):
-    """Export chat history to CSV"""
-    data = []
-    for item in chat_history:
-        data.append({
-            "Question": item["question"],
-            "Answer": item["answer"],
-            "Chart Type": item.get("chart_type", "none")
-        })
-    df = pd.DataFrame(data)
-    return df.to_csv(index=False).encode('utf-8')
-
-def export_to_pdf(chat_history):
-    """Export chat history to PDF"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
+def _render_answer(idx: int, item: Dict[str, Any]):
+    """Render the assistant side of a chat turn (answer, chart, recommendations)"""
+    st.write(item["answer"])
+    
+    if item.get("chart_type") and item["chart_type"] != "none":
+        # Stable per-turn key lets Streamlit match the chart element across reruns
+        render_chart(item["chart_type"], item.get("chart_key"), key=f"chart_{idx}")
+    
+    if item.get("recommendations"):
+        st.info("**Recommendations:**\n" + "\n".join([f"• {r}" for r in item["recommendations"]]))
+
+def _render_message(idx: int, item: Dict[str, Any]):
+    """Replay one past chat turn"""
+    with st.chat_message("user"):
+        st.write(item["question"])
+    
+    with st.chat_message("assistant"):
+        _render_answer(idx, item)
+
+def _append_turn(item: Dict[str, Any]):
+    """Commit a chat turn to history and the incremental export state"""
+    st.session_state.chat_history.append(item)
+    csv.writer(st.session_state.csv_buf).writerow(
+        [item["question"], item["answer"], item.get("chart_type", "none")]
+    )
+    st.session_state.pdf_version += 1
+
+def _reset_history():
+    """Start a fresh conversation (e.g. after a new upload)"""
+    st.session_state.chat_history = []
+    st.session_state.chart_cache = OrderedDict()
+    st.session_state.csv_buf = _new_csv_buffer()
+    st.session_state.pdf_version = 0
+
+def _queue_question():
+    """chat_input callback: hand the submitted question to chat_panel"""
+    st.session_state.pending_question = st.session_state.chat_question
+
+@st.fragment
+def chat_panel():
+    """
+    Chat history, the pending answer and exports. The chat input stays at
+    the top level so it is pinned to the bottom of the page; it passes the
+    question through session state, which fragment-only reruns cannot replay.
+    """
+    # Display chat history (charts come from the figure cache)
+    for idx, item in enumerate(st.session_state.chat_history):
+        _render_message(idx, item)
+    
+    user_question = st.session_state.pop("pending_question", None)
+    
+    if user_question:
+        # Add user message
+        with st.chat_message("user"):
+            st.write(user_question)
+        
+        # Get AI response
+        with st.chat_message("assistant"):
+            with st.spinner("Analyzing..."):
+                response = query_data(st.session_state.file_id, user_question)
+                
+                if response:
+                    item = {
+                        "question": user_question,
+                        "answer": response["answer_text"],
+                        "chart_type": response.get("chart_type"),
+                        "chart_key": _store_chart(response.get("chart_type"), response.get("chart_data")),
+                        "recommendations": response.get("recommendations")
+                    }
+                    _render_answer(len(st.session_state.chat_history), item)
+                    
+                    # Add to chat history; the next fragment run replays it
+                    _append_turn(item)
+    
+    export_panel()
+
+def export_panel():
+    """CSV/PDF downloads of the chat history, rendered inside chat_panel"""
+    st.divider()
+    st.subheader("📥 Export")
+    
+    # Lives in the chat fragment so every new turn re-renders it: the
+    # downloads disappear until the next click and never serve an older
+    # history. Files are only built on request.
+    if st.button("Prepare Export"):
+        if not st.session_state.chat_history:
+            st.caption("Ask a question first to export the analysis.")
+        else:
+            csv_data = export_to_csv(st.session_state.csv_buf)
+            st.download_button(
+                label="Download as CSV",
+                data=csv_data,
+                file_name="analysis_report.csv",
+                mime="text/csv"
+            )
+            
+            pdf_data = export_to_pdf(
+                st.session_state.file_id,
+                st.session_state.pdf_version,
+                st.session_state.chat_history
+            )
+            st.download_button(
+                label="Download as PDF",
+                data=pdf_data,
+                file_name="analysis_report.pdf",
+                mime="application/pdf"
+            )
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _schema_df(file_id: str, _schema: Dict[str, str]) -> pd.DataFrame:
+    """Schema table for a file; file_ids are unique per upload, so they key the cache"""
+    return pd.DataFrame(list(_schema.items()), columns=["Column", "Type"])
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _sample_df(file_id: str, _sample_rows: list) -> pd.DataFrame:
+    """Sample rows preview for a file, keyed like _schema_df"""
+    return pd.DataFrame(_sample_rows)
+
+def export_to_csv(csv_buf: io.StringIO) -> bytes:
+    """Export chat history to CSV from the incrementally written buffer"""
+    return csv_buf.getvalue().encode('utf-8')
+
+@st.cache_resource
+def _pdf_styles():
+    """ReportLab styles are immutable once built; share them across exports"""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
+    
     styles = getSampleStyleSheet()
+    cell_style = ParagraphStyle("ReportCell", parent=styles['Normal'])
+    table_style = TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ])
+    return styles, cell_style, table_style
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _pdf_bytes(file_id: str, pdf_version: int, _chat_history: list) -> bytes:
+    """Render chat history to PDF bytes; cached per (file, history version)"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
     
-    # Title
-    title = Paragraph("AI Data Copilot - Analysis Report", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 12))
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles, cell_style, table_style = _pdf_styles()
     
-    # Chat history
-    for i, item in enumerate(chat_history, 1):
-        question = Paragraph(f"<b>Q{i}:</b> {item['question']}", styles['Normal'])
-        answer = Paragraph(f"<b>A{i}:</b> {item['answer']}", styles['Normal'])
-        elements.append(question)
-        elements.append(Spacer(1, 6))
-        elements.append(answer)
-        elements.append(Spacer(1, 12))
+    # Chat history as one two-column table (label | text) laid out in a
+    # single pass. Text is escaped so user/LLM content is never parsed as markup.
+    rows = []
+    for i, item in enumerate(_chat_history, 1):
+        rows.append([f"Q{i}", Paragraph(escape(item["question"]), cell_style)])
+        rows.append([f"A{i}", Paragraph(escape(item["answer"]), cell_style)])
         
         # Add recommendations if available
-        if item.get('recommendations'):
-            rec_text = "<b>Recommendations:</b><br/>" + "<br/>".join([f"• {r}" for r in item['recommendations']])
-            recommendations = Paragraph(rec_text, styles['Normal'])
-            elements.append(recommendations)
-            elements.append(Spacer(1, 12))
+        recs = item.get("recommendations")
+        if recs:
+            rec_text = "<b>Recommendations:</b><br/>" + "<br/>".join([f"• {escape(str(r))}" for r in recs])
+            rows.append(["", Paragraph(rec_text, cell_style)])
+    
+    elements = [
+        Paragraph("AI Data Copilot - Analysis Report", styles['Title']),
+        Spacer(1, 12),
+        # splitInRow lets an answer longer than a page continue on the next one
+        Table(rows, colWidths=[36, doc.width - 36], style=table_style, splitInRow=1)
+    ]
     
     doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
+
+def export_to_pdf(file_id: str, pdf_version: int, chat_history) -> bytes:
+    """Export chat history to PDF"""
+    return _pdf_bytes(file_id, pdf_version, chat_history)
 
 # Main UI
 st.markdown('<div class="main-header">📊 AI Data Copilot</div>', unsafe_allow_html=True)
@@ -216,7 +550,7 @@ with st.sidebar:
             if metadata:
                 st.session_state.file_id = metadata["file_id"]
                 st.session_state.metadata = metadata
-                st.session_state.chat_history = []
+                _reset_history()
                 st.success("✅ File processed successfully!")
     
     if st.session_state.metadata:
@@ -226,37 +560,14 @@ with st.sidebar:
         st.metric("Columns", st.session_state.metadata["column_count"])
         
         with st.expander("View Schema"):
-            schema_df = pd.DataFrame(
-                list(st.session_state.metadata["schema"].items()),
-                columns=["Column", "Type"]
-            )
+            schema_df = _schema_df(st.session_state.file_id, st.session_state.metadata["schema"])
             st.dataframe(schema_df, use_container_width=True)
-        
-        st.divider()
-        st.subheader("📥 Export")
-        
-        if st.session_state.chat_history:
-            csv_data = export_to_csv(st.session_state.chat_history)
-            st.download_button(
-                label="Download as CSV",
-                data=csv_data,
-                file_name="analysis_report.csv",
-                mime="text/csv"
-            )
-            
-            pdf_data = export_to_pdf(st.session_state.chat_history)
-            st.download_button(
-                label="Download as PDF",
-                data=pdf_data,
-                file_name="analysis_report.pdf",
-                mime="application/pdf"
-            )
 
 # Main content area
 if st.session_state.metadata:
     # Display sample data
     with st.expander("🔍 Preview Sample Data", expanded=True):
-        sample_df = pd.DataFrame(st.session_state.metadata["sample_rows"])
+        sample_df = _sample_df(st.session_state.file_id, st.session_state.metadata["sample_rows"])
         st.dataframe(sample_df, use_container_width=True)
     
     st.divider()
@@ -264,54 +575,10 @@ if st.session_state.metadata:
     # Chat interface
     st.subheader("💬 Ask Questions About Your Data")
     
-    # Display chat history
-    for item in st.session_state.chat_history:
-        with st.chat_message("user"):
-            st.write(item["question"])
-        
-        with st.chat_message("assistant"):
-            st.write(item["answer"])
-            
-            if item.get("chart_type") and item["chart_type"] != "none":
-                render_chart(item["chart_type"], item.get("chart_data"))
-            
-            if item.get("recommendations"):
-                st.info("**Recommendations:**\n" + "\n".join([f"• {r}" for r in item["recommendations"]]))
+    chat_panel()
     
     # Chat input
-    user_question = st.chat_input("Ask a question about your data...")
-    
-    if user_question:
-        # Add user message
-        with st.chat_message("user"):
-            st.write(user_question)
-        
-        # Get AI response
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing..."):
-                response = query_data(st.session_state.file_id, user_question)
-                
-                if response:
-                    st.write(response["answer_text"])
-                    
-                    # Render chart if available
-                    if response.get("chart_type") and response["chart_type"] != "none":
-                        render_chart(response["chart_type"], response.get("chart_data"))
-                    
-                    # Show recommendations
-                    if response.get("recommendations"):
-                        st.info("**Recommendations:**\n" + "\n".join([f"• {r}" for r in response["recommendations"]]))
-                    
-                    # Add to chat history
-                    st.session_state.chat_history.append({
-                        "question": user_question,
-                        "answer": response["answer_text"],
-                        "chart_type": response.get("chart_type"),
-                        "chart_data": response.get("chart_data"),
-                        "recommendations": response.get("recommendations")
-                    })
-                    
-                    st.rerun()
+    st.chat_input("Ask a question about your data...", key="chat_question", on_submit=_queue_question)
 else:
     # Welcome screen
     st.info("👈 Please upload a CSV or Excel file to get started")